@@ -1,6 +1,10 @@
-from collections import deque
+from collections import deque, defaultdict
+from collections.abc import Iterable
+from heapq import heappop, heappush
+from itertools import count
+from operator import attrgetter
 
-from senere.routing import build_static_routes, build_routes
+from senere.routing import build_static_routes, build_routes, RouteRecord
 from senere.topology import GATEWAY_NODE, Node, SENSOR_NODE
 
 
@@ -62,48 +66,76 @@ class RoutingManager:
     def __init__(self, owner):
         assert hasattr(owner, '_table')
         self.__owner = owner
+        # Reverse index: next hop -> sources of routes going via it
+        self.__precursors = defaultdict(set)
+        # Addresses, which routes were removed and not added again:
+        self.__removed = set()
 
     @property
     def table(self):
         return getattr(self.__owner, '_table')
 
     def add(self, route_record):
-        self.table[route_record.source] = route_record
+        source = route_record.source
+        self.__unlink(self.table.get(source))
+        self.table[source] = route_record
+        self.__removed.discard(source)
+        if route_record.next_hop != source:
+            self.__precursors[route_record.next_hop].add(source)
 
     def remove(self, address):
         try:
-            del self.table[address]
-            return 1
+            record = self.table.pop(address)
         except KeyError:
             return 0
+        self.__unlink(record)
+        self.__removed.add(address)
+        return 1
+
+    def removed(self):
+        """Get a list of addresses, which routes were removed.
+        """
+        return list(self.__removed)
+
+    def count_removed(self):
+        return len(self.__removed)
+
+    def precursors(self, address):
+        """Get a list of nodes using the given node as the next hop.
+        """
+        return list(self.__precursors.get(address, ()))
+
+    def __unlink(self, record):
+        if record is not None and record.next_hop != record.source:
+            self.__precursors[record.next_hop].discard(record.source)
 
     def all(self, order_by=None):
         records = list(self.table.values())
         if order_by is None:
             return records
-        records.sort(key=lambda rec: getattr(rec, order_by))
+        records.sort(key=attrgetter(order_by))
         return records
 
     def get(self, address):
         return self.table[address]
 
     def filter(self, order_by=None, **kwargs):
-        records = self.all()
+        # Collect all predicates first, and check them in a single pass
+        # over the table instead of filtering the records list repeatedly:
+        predicates = []
         if 'address' in kwargs:
             target = kwargs['address']
-            records = [r for r in records if
-                       r.source == target or r.hext_hop == target]
-        if 'source' in kwargs:
-            records = [r for r in records if r.source == kwargs['source']]
-        if 'next_hop' in kwargs:
-            records = [r for r in records if r.next_hop == kwargs['next_hop']]
-        if 'static' in kwargs:
-            records = [r for r in records if r.static == kwargs['static']]
-        if 'distance' in kwargs:
-            records = [r for r in records if r.distance == kwargs['distance']]
+            predicates.append(
+                lambda r: r.source == target or r.next_hop == target)
+        for field in ('source', 'next_hop', 'static', 'distance'):
+            if field in kwargs:
+                predicates.append(
+                    lambda r, f=field, v=kwargs[field]: getattr(r, f) == v)
+        records = [r for r in self.table.values() if r is not None and
+                   all(predicate(r) for predicate in predicates)]
         # Ordering:
         if order_by is not None:
-            records.sort(key=lambda r: getattr(r, order_by))
+            records.sort(key=attrgetter(order_by))
         return records
 
 
@@ -116,22 +148,38 @@ class Network:
         self.devices = {
             node.address: create_device(node) for node in topology.nodes.all()
         }
+        # Node types never change, so we split addresses by device types
+        # once. Turned off devices are tracked here as well, since they are
+        # turned on and off via the network only:
+        self.__sensors = [
+            a for a, d in self.devices.items() if isinstance(d, Sensor)]
+        self.__gateways = [
+            a for a, d in self.devices.items() if isinstance(d, Gateway)]
+        self.__turned_off = {
+            a for a, d in self.devices.items() if d.turned_off}
         # Initiating routing table:
         self._table = {address: None for address in self.devices.keys()}
         self.__routing_manager = RoutingManager(self)
+        # Routing mode is defined when the routing table is built. After
+        # that, routes are repaired incrementally when nodes are turned
+        # on or off. Neighbours and static precursors are needed only
+        # for repair, so they are built on the first use:
+        self.__mode = None
+        self.__neighbours = None
+        self.__static_precursors = None
 
     @property
     def topology(self):
         return self.__topology
 
     def sensors(self):
-        return [a for a, d in self.devices.items() if isinstance(d, Sensor)]
+        return list(self.__sensors)
 
     def gateways(self):
-        return [a for a, d in self.devices.items() if isinstance(d, Gateway)]
+        return list(self.__gateways)
 
     def turned_off(self):
-        return [a for a, d in self.devices.items() if d.turned_off]
+        return list(self.__turned_off)
 
     @property
     def routing_table(self):
@@ -139,6 +187,9 @@ class Network:
 
     def build_routing_table(self, mode=STATIC):
         """Connect nodes to gates via either shortest paths or static routes.
+
+        After the table is built, `turn_off()` and `turn_on()` keep it up
+        to date in the given mode, so there is no need to rebuild it.
         """
         route_builder = {
             Network.STATIC: build_static_routes,
@@ -147,32 +198,119 @@ class Network:
         routes = route_builder[mode](self.__topology, exclude=self.turned_off())
         for route in routes:
             self.routing_table.add(route)
+        self.__mode = mode
 
     def turn_off(self, address):
         """Turn node off and remove all its connections.
+
+        If routing table was built in dynamic mode, nodes which lost their
+        routes are re-routed via other neighbours, if possible.
         """
         self.devices[address].turn_off()
+        self.__turned_off.add(address)
         # Removing all routes going through this device:
+        detached = []
         queue = deque([address])
-        unconnected_nodes = []
         while queue:
             node = queue.popleft()
-            unconnected_nodes.append(node)
-            self.routing_table.remove(node)
-            for route in self.routing_table.all():
-                if route.next_hop in unconnected_nodes:
-                    queue.append(route.source)
+            queue.extend(self.routing_table.precursors(node))
+            if self.routing_table.remove(node) and node != address:
+                detached.append(node)
+        # Only detached nodes may need new routes, since distances to all
+        # other nodes didn't change:
+        if self.__mode == Network.DYNAMIC:
+            self.__update_dynamic_routes(detached)
 
     def turn_on(self, target):
         """Turn one or multiple nodes on.
+
+        If routing table was already built, routes for the turned on nodes
+        and nodes which can be connected via them are added to it.
         """
-        try:
-            for address in target:
-                self.devices[address].turn_on()
-        except TypeError:
-            self.devices[target].turn_on()
+        if isinstance(target, Iterable) and not isinstance(target, str):
+            addresses = list(target)
+        else:
+            addresses = [target]
+        for address in addresses:
+            self.devices[address].turn_on()
+            self.__turned_off.discard(address)
+        if self.__mode == Network.STATIC:
+            self.__update_static_routes(addresses)
+        elif self.__mode == Network.DYNAMIC:
+            self.__update_dynamic_routes(addresses)
+
+    def __update_static_routes(self, addresses):
+        """Restore static routes of the given nodes and their precursors.
+        """
+        if self.__static_precursors is None:
+            self.__static_precursors = defaultdict(list)
+            for from_addr, to_addr in self.__topology.connections.items():
+                self.__static_precursors[to_addr].append(from_addr)
+        connections = self.__topology.connections
+        queue = deque()
+        for address in addresses:
+            if connections.has_next_hop(address):
+                next_hop = connections.get_next_hop(address)
+                route = self._table.get(next_hop)
+                if route is not None:
+                    queue.append((address, next_hop, route.gateway,
+                                  route.distance + 1))
+        while queue:
+            node, next_hop, gw, dist = queue.popleft()
+            if self._table.get(node) is not None:
+                continue
+            self.routing_table.add(RouteRecord(node, next_hop, gw, dist, True))
+            queue.extend(
+                (p, node, gw, dist + 1) for p in self.__static_precursors[node]
+                if p not in self.__turned_off)
+
+    def __update_dynamic_routes(self, addresses):
+        """Find shortest routes for the given nodes and update the routes of
+        other nodes, if they become shorter.
+
+        Since distances to nodes routed via the given ones may change
+        differently, we use Dijkstra algorithm, starting from the given
+        nodes with distances via their routed neighbours.
+        """
+        if self.__neighbours is None:
+            self.__neighbours = self.__topology.neighbours()
+        neighbours = self.__neighbours
+        table = self._table
+        order = count()  # to avoid comparing addresses in the heap
+        heap = []
+        for address in addresses:
+            for v in neighbours[address]:
+                route = table.get(v)
+                if route is not None:
+                    dist = route.distance + 1
+                    heappush(heap, (dist, next(order), address, v))
+        while heap:
+            dist, _, node, next_hop = heappop(heap)
+            route = table.get(node)
+            if route is not None and route.distance <= dist:
+                continue
+            gw = table[next_hop].gateway
+            self.routing_table.add(
+                RouteRecord(node, next_hop, gw, dist, False))
+            for v in neighbours[node]:
+                if v in self.__turned_off:
+                    continue
+                route = table.get(v)
+                if route is None or route.distance > dist + 1:
+                    heappush(heap, (dist + 1, next(order), v, node))
+
+    @property
+    def num_offline(self):
+        """Get the number of offline nodes without building their list.
+
+        Routes are removed only when sensors are turned off (gateways can
+        not be turned off), so the removed routes count equals the number
+        of offline nodes.
+        """
+        return self.routing_table.count_removed()
 
     def get_offline_nodes(self):
         """Get a list of all nodes either turned off or lost their connections.
         """
-        return [addr for addr in self.sensors() if addr not in self._table]
+        return [addr for addr in self.routing_table.removed()
+                if isinstance(self.devices[addr], Sensor)]
@@ -1,5 +1,7 @@
 defaults = {
     'num_runs': 1,
+    'num_workers': 1,
+    'failure_batch_size': 1024,
     'stime_limit': 1000,
     'radio_range': 100,
     'sensor_color': 'lightblue',
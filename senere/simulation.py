@@ -1,3 +1,6 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
 import numpy as np
 from pydesim import Model, simulate, Trace, Logger
 
@@ -11,24 +14,17 @@ __all__ = [
 ]
 
 
-def pmf_to_array(pmf):
-    if not pmf:
-        return np.asarray([])
-    order = max(pmf.keys()) + 1
-    result = np.zeros(order)
-    for key, value in pmf.items():
-        result[key] = value
-    return result
-
-
 def average_pmfs(pmfs):
+    pmfs = list(pmfs)
     if not pmfs:
         raise ValueError
-    vectors = [pmf_to_array(pmf) for pmf in pmfs]
-    max_order = max(len(v) for v in vectors)
-    num_vectors = len(vectors)
-    vectors = (np.hstack((v, np.zeros(max_order - len(v)))) for v in vectors)
-    return sum(vectors) / num_vectors
+    # Accumulate all PMFs in a single zero-padded vector, and average it:
+    max_order = max((max(pmf.keys()) + 1 if pmf else 0) for pmf in pmfs)
+    result = np.zeros(max_order)
+    for pmf in pmfs:
+        for key, value in pmf.items():
+            result[key] += value
+    return result / len(pmfs)
 
 
 # noinspection PyProtectedMember
@@ -50,19 +46,28 @@ def average_sample_traces(traces):
 
 class _SimRet:
     def __init__(self, results):
-        _rs = [r.data for r in results]
-        n = len(_rs)
-        self.num_failed_pmf = average_pmfs([r.num_failed.pmf() for r in _rs])
-        self.num_failed_avg = np.average([r.num_failed.timeavg() for r in _rs])
-        self.num_offline_pmf = average_pmfs([r.num_offline.pmf() for r in _rs])
-        self.num_offline_avg = np.average(
-            [r.num_offline.timeavg() for r in _rs])
-        self.operable = sum(r.operable.timeavg() for r in _rs) / n
-        self.num_failed_sampled = average_sample_traces(
-            r.num_failed_sampled for r in _rs)
-        self.num_offline_sampled = average_sample_traces(
-            r.num_offline_sampled for r in _rs)
-        self.runs = results
+        self.runs = list(results)
+        n = len(self.runs)
+        # Collect statistics of all runs in a single pass:
+        failed_pmfs, offline_pmfs = [], []
+        failed_sampled, offline_sampled = [], []
+        failed_sum, offline_sum, operable_sum = 0.0, 0.0, 0.0
+        for run in self.runs:
+            data = run.data
+            failed_pmfs.append(data.num_failed.pmf())
+            offline_pmfs.append(data.num_offline.pmf())
+            failed_sum += data.num_failed.timeavg()
+            offline_sum += data.num_offline.timeavg()
+            operable_sum += data.operable.timeavg()
+            failed_sampled.append(data.num_failed_sampled)
+            offline_sampled.append(data.num_offline_sampled)
+        self.num_failed_pmf = average_pmfs(failed_pmfs)
+        self.num_failed_avg = failed_sum / n
+        self.num_offline_pmf = average_pmfs(offline_pmfs)
+        self.num_offline_avg = offline_sum / n
+        self.operable = operable_sum / n
+        self.num_failed_sampled = average_sample_traces(failed_sampled)
+        self.num_offline_sampled = average_sample_traces(offline_sampled)
 
 
 class ModelData(Model):
@@ -75,8 +80,17 @@ class ModelData(Model):
         # We use it as a template for network creation.
         self.network = Network(sim.params.topology)
         self.repair_started = False
+        # Failed nodes are kept in a list to select a random node for repair,
+        # and their positions in this list are indexed to remove them in O(1):
         self.failed_nodes = []
+        self.failed_nodes_index = {}
         self.routing_mode = sim.params.routing_mode
+        # Random generator for the model own sampling (user-provided
+        # interval functions may use their own generators):
+        self.rng = np.random.default_rng(getattr(sim.params, 'seed', None))
+        # If failure interval is given by a mean value, intervals are
+        # exponentially distributed and drawn in batches:
+        self.failure_intervals = []
         sim.logger.level = sim.params.log_level
 
         # Statistics:
@@ -88,7 +102,7 @@ class ModelData(Model):
 
         # Record initial trace data:
         t = sim.stime
-        num_offline = len(self.network.get_offline_nodes())
+        num_offline = self.network.num_offline
         self.num_failed.record(t, 0)
         self.num_failed_sampled.record(t, 0)
         self.num_offline.record(t, num_offline)
@@ -113,16 +127,16 @@ class ModelData(Model):
            already failed:
            if num_offline_nodes > num_offline_till_repair, start the repair.
         """
-        self.network.turn_off(node)
-        self.failed_nodes.append(node)
-
         # If static routing is used, no actual re-routing will take place.
         # However, in case of dynamic routing using, this can lead to
-        # network reconfiguration and new alternative paths
-        self.network.build_routing_table(self.routing_mode)
+        # network reconfiguration and new alternative paths. The network
+        # updates its routing table itself when the node is turned off.
+        self.network.turn_off(node)
+        self.failed_nodes_index[node] = len(self.failed_nodes)
+        self.failed_nodes.append(node)
 
         # Count failed and offline nodes and record statistics:
-        num_offline_nodes = len(self.network.get_offline_nodes())
+        num_offline_nodes = self.network.num_offline
         num_failed_nodes = len(self.failed_nodes)
         self.num_failed.record(self.sim.stime, num_failed_nodes)
         self.num_offline.record(self.sim.stime, num_offline_nodes)
@@ -144,18 +158,17 @@ class ModelData(Model):
         Here we assume that during repair all failed nodes were fixed,
         so we schedule their failures again.
         """
-        # Turn on the repaired node, rebuild a routing table and schedule the
-        # next failure:
+        # Turn on the repaired node (this also updates the routing table)
+        # and schedule the next failure:
         self.sim.logger.debug(f'node {node} repair finished')
         self.network.turn_on(node)
-        self.network.build_routing_table(self.routing_mode)
         self.schedule_failure(node)
 
         # Remove the repaired node from the failed list, count failed and
         # offline nodes:
-        self.failed_nodes.remove(node)
+        self.remove_failed_node(node)
         num_failed = len(self.failed_nodes)
-        num_offline = len(self.network.get_offline_nodes())
+        num_offline = self.network.num_offline
 
         # Record statistics:
         t = self.sim.stime
@@ -176,20 +189,45 @@ class ModelData(Model):
 
     def handle_sample_timeout(self):
         t = self.sim.stime
-        num_offline = len(self.network.get_offline_nodes())
+        num_offline = self.network.num_offline
         self.num_failed_sampled.record(t, len(self.failed_nodes))
         self.num_offline_sampled.record(t, num_offline)
         self.sim.schedule(self.sim.params.sample_interval,
                           self.handle_sample_timeout)
 
+    def remove_failed_node(self, node):
+        """Remove a node from the failed nodes list by replacing it with
+        the last failed node. Order of failed nodes doesn't matter, since
+        nodes for repair are selected randomly.
+        """
+        index = self.failed_nodes_index.pop(node)
+        last_node = self.failed_nodes.pop()
+        if last_node != node:
+            self.failed_nodes[index] = last_node
+            self.failed_nodes_index[last_node] = index
+
     def schedule_failure(self, node):
         """Schedule next failure event for a given node.
 
         :param node: network node
         """
-        interval = self.sim.params.failure_interval()
+        interval = self.next_failure_interval()
         self.sim.schedule(interval, self.handle_failure, args=(node,))
 
+    def next_failure_interval(self):
+        """Get the next failure interval. If `failure_interval` parameter
+        is a number, it is treated as a mean of exponential distribution.
+        """
+        failure_interval = self.sim.params.failure_interval
+        if callable(failure_interval):
+            return failure_interval()
+        if not self.failure_intervals:
+            batch_size = getattr(self.sim.params, 'failure_batch_size',
+                                 defaults['failure_batch_size'])
+            self.failure_intervals = self.rng.exponential(
+                failure_interval, size=batch_size).tolist()
+        return self.failure_intervals.pop()
+
     def schedule_next_repair(self):
         """Schedule next repair duration. Since all broken nodes are
         repaired at once, we do not distinguish nodes here.
@@ -198,7 +236,7 @@ class ModelData(Model):
             raise RuntimeError('can not schedule repair - no failed nodes')
 
         # Select a random node to repair, and schedule repair end:
-        node_index = np.random.randint(len(self.failed_nodes))
+        node_index = self.rng.integers(len(self.failed_nodes))
         node = self.failed_nodes[node_index]
 
         if not self.repair_started:
@@ -212,25 +250,88 @@ class ModelData(Model):
                           args=(node,))
 
 
+def _simulate_run(stime_limit, params, seed=None):
+    """Run a single simulation. This is a module-level function, so it can
+    be sent to worker processes.
+
+    The seed is used both for NumPy global random generator (which is
+    typically used by interval functions), and for the model generator.
+    """
+    if seed is not None:
+        np.random.seed(seed)
+    params = dict(params, seed=seed)
+    return simulate(ModelData, stime_limit=stime_limit, params=params)
+
+
 def simulate_network(topology, failure_interval, repair_interval,
                      num_offline_till_repair=2, **kwargs):
+    """Simulate the network `num_runs` times and average the results.
+
+    `failure_interval` is either a callable returning the next interval
+    between node failures, or a number. In the latter case, intervals are
+    exponentially distributed with this mean, and they are drawn in
+    batches of `failure_batch_size`, which is much faster than calling
+    a function per failure.
+    `repair_interval` and `cons_repair_interval` are callables.
+
+    Runs are independent, so they may be executed in parallel processes
+    if `num_workers > 1` is given. In this case all parameters, including
+    `failure_interval` and `repair_interval` callables, must be picklable,
+    so use module-level functions instead of lambdas. Note that pickling
+    methods of a random generator (like `partial(np.random.exponential,
+    10)`) copies the generator, so seeding doesn't affect them - call
+    `np.random.exponential()` inside the function instead.
+
+    If `seed` is given, run `i` seeds NumPy global random generator and
+    the model generator with `seed + i`, so the results are reproducible
+    and don't depend on `num_workers`. Without a seed, per-run seeds are
+    drawn from NumPy global random generator, so calling `np.random.seed()`
+    before the simulation still makes the results reproducible, and worker
+    processes don't repeat the same random sequence. In both cases the
+    global generator state after the simulation doesn't depend on the runs.
+    """
     stime_limit = kwargs.get('stime_limit', defaults['stime_limit'])
     num_runs = kwargs.get('num_runs', defaults['num_runs'])
+    num_workers = kwargs.get('num_workers', defaults['num_workers'])
+    seed = kwargs.get('seed', None)
     log_level = kwargs.get('log_level', Logger.Level.ERROR)
     routing_mode = {'static': Network.STATIC, 'dynamic': Network.DYNAMIC
                     }[kwargs.get('routing_mode', 'static')]
     cons_repair_interval = kwargs.get('cons_repair_interval', repair_interval)
-    results = []
-    for i_run in range(num_runs):
-        results.append(simulate(ModelData, stime_limit=stime_limit, params={
-            'topology': topology,
-            'routing_mode': routing_mode,
-            'failure_interval': failure_interval,
-            'repair_interval': repair_interval,
-            'num_offline_till_repair': num_offline_till_repair,
-            'log_level': log_level,
-            'cons_repair_interval': cons_repair_interval,
-            'record_samples': kwargs.get('record_samples', False),
-            'sample_interval': kwargs.get('sample_interval', 1),
-        }))
+
+    if seed is not None:
+        seeds = [seed + i_run for i_run in range(num_runs)]
+    else:
+        seeds = np.random.randint(2**31, size=num_runs).tolist()
+
+    # Parameters are the same for all runs, only seeds differ:
+    params = {
+        'topology': topology,
+        'routing_mode': routing_mode,
+        'failure_interval': failure_interval,
+        'repair_interval': repair_interval,
+        'num_offline_till_repair': num_offline_till_repair,
+        'log_level': log_level,
+        'cons_repair_interval': cons_repair_interval,
+        'record_samples': kwargs.get('record_samples', False),
+        'sample_interval': kwargs.get('sample_interval', 1),
+        'failure_batch_size': kwargs.get(
+            'failure_batch_size', defaults['failure_batch_size']),
+    }
+    run = partial(_simulate_run, stime_limit, params)
+
+    if num_workers > 1 and num_runs > 1:
+        # Split runs into one chunk per worker, so the parameters (including
+        # the topology) are sent to each worker once, not with every run:
+        chunksize = -(-num_runs // num_workers)
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            results = list(executor.map(run, seeds, chunksize=chunksize))
+    else:
+        # Runs seed NumPy global random generator, so restore its state
+        # afterwards, as if the runs were executed in other processes:
+        state = np.random.get_state()
+        try:
+            results = [run(run_seed) for run_seed in seeds]
+        finally:
+            np.random.set_state(state)
     return _SimRet(results)
@@ -1,3 +1,7 @@
+from collections import defaultdict
+from math import hypot
+from operator import attrgetter, itemgetter
+
 import networkx as nx
 
 import numpy as np
@@ -8,9 +12,15 @@ from senere.utilities import GridArea
 SENSOR_NODE = 'sensor'
 GATEWAY_NODE = 'gateway'
 
+# Number of nodes, which distances to all other nodes are compared at once
+# when building the neighbourhood:
+_NEIGHBOURS_BLOCK_SIZE = 256
+
 
 # noinspection PyShadowingBuiltins
 class Node:
+    __slots__ = ('address', 'type', 'x', 'y', 'radio_range')
+
     def __init__(self, address, type=SENSOR_NODE, x=0, y=0,
                  radio_range=None):
         self.address = address
@@ -31,7 +41,11 @@ class Node:
             yield val
 
     def __eq__(self, other):
-        return tuple(self) == tuple(other)
+        if not isinstance(other, Node):
+            return tuple(self) == tuple(other)
+        return ((self.address, self.type, self.x, self.y, self.radio_range) ==
+                (other.address, other.type, other.x, other.y,
+                 other.radio_range))
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -42,8 +56,15 @@ def position_of(node):
 
 
 def distance_between(node_a, node_b):
-    r = position_of(node_a) - position_of(node_b)
-    return np.sqrt(r.dot(r))
+    return hypot(node_a.x - node_b.x, node_a.y - node_b.y)
+
+
+def in_radio_range(node_a, node_b):
+    # Compare squared distance to avoid computing square root:
+    dx, dy = node_a.x - node_b.x, node_a.y - node_b.y
+    range_a, range_b = node_a.radio_range, node_b.radio_range
+    radio_range = range_a if range_a < range_b else range_b
+    return dx * dx + dy * dy <= radio_range * radio_range
 
 
 class Topology:
@@ -52,10 +73,18 @@ class Topology:
         connections = connections or []
         self._nodes = {n.address: n for n in nodes}
         self._connections = {c[0]: c[1] for c in connections}
+        # Neighbourhood cached by neighbours() with the nodes fingerprint:
+        self._neighbours = None
+        self._neighbours_key = None
+        # Secondary indices, kept by the managers:
+        # - `_nodes_by_type`: node type -> {address: node}
+        # - `_incoming`: to_addr -> {from_addr, ...}
+        self._nodes_by_type = defaultdict(dict)
+        self._incoming = defaultdict(set)
+        self._build_indices()
         self.__nodes_manager = NodesManager(self)
-        self.__connections_manager = ConnectionsManager(self, can_connect=(
-            lambda src, dst: (distance_between(src, dst) <=
-                              min(src.radio_range, dst.radio_range))))
+        self.__connections_manager = ConnectionsManager(
+            self, can_connect=in_radio_range)
 
     @property
     def nodes(self):
@@ -65,22 +94,28 @@ class Topology:
     def connections(self):
         return self.__connections_manager
 
+    def _graph_nodes(self):
+        """Get a list of `(address, attributes)` pairs to add nodes to
+        a NetworkX graph in a single pass over nodes.
+        """
+        return [(node.address, {
+            'address': node.address, 'type': node.type, 'x': node.x,
+            'y': node.y, 'radio_range': node.radio_range,
+        }) for node in self._nodes.values()]
+
     def get_connections_graph(self):
         graph = nx.DiGraph()
-        nodes = self.nodes.values(['address', 'type', 'x', 'y', 'radio_range'])
-        graph.add_nodes_from((n['address'], n) for n in nodes)
-        graph.add_edges_from(self.connections.all())
+        graph.add_nodes_from(self._graph_nodes())
+        graph.add_edges_from(self.connections.items())
         return graph
 
     def get_neighbours_graph(self):
         graph = nx.Graph()
-        nodes = self.nodes.values(['address', 'type', 'x', 'y', 'radio_range'])
-        graph.add_nodes_from((n['address'], n) for n in nodes)
-        nodes_list = graph.nodes()
-        for address_a, adj_list in self.neighbours().items():
-            for address_b in adj_list:
-                node_a, node_b = nodes_list[address_a], nodes_list[address_b]
-                graph.add_edge(node_a, node_b)
+        graph.add_nodes_from(self._graph_nodes())
+        graph.add_edges_from(
+            (address_a, address_b)
+            for address_a, adj_list in self.neighbours().items()
+            for address_b in adj_list)
         return graph
 
     def draw(self, **kwargs):
@@ -127,27 +162,28 @@ class Topology:
             Line style of the edges representing neighbourhood relation
             (solid|dashed|dotted,dashdot)
         """
-        conn_graph = self.get_connections_graph()
-        node_list = conn_graph.nodes(data=True)
+        nodes = self._graph_nodes()
 
         # Assigning positions:
-        positions = {node: (attr['x'], attr['y']) for node, attr in node_list}
+        positions = {address: (attrs['x'], attrs['y'])
+                     for address, attrs in nodes}
 
         # Assigning colors:
         colors_dict = {
             SENSOR_NODE: kwargs.get('sensor_color', defaults['sensor_color']),
             GATEWAY_NODE: kwargs.get('gw_color', defaults['gw_color'])
         }
-        colors = [colors_dict[attrs['type']] for _, attrs in node_list]
+        colors = [colors_dict[attrs['type']] for _, attrs in nodes]
 
-        # Build a new graph:
+        # Build the graph directly from nodes and connections:
         graph = nx.MultiGraph()
-        graph.add_nodes_from(node_list)
+        graph.add_nodes_from(nodes)
 
         if kwargs.get('conn_edges', True):
             style = kwargs.get('conn_line_style', defaults['conn_line_style'])
             width = kwargs.get('conn_line_width', defaults['conn_line_width'])
-            graph.add_edges_from(conn_graph.edges(), style=style, width=width)
+            graph.add_edges_from(
+                self.connections.items(), style=style, width=width)
 
         if kwargs.get('neigh_edges', False):
             style = kwargs.get('neigh_line_style', defaults['neigh_line_style'])
@@ -173,15 +209,55 @@ class Topology:
                          width=width, **kds)
 
     def neighbours(self):
+        """Get a dictionary `address -> [addresses of neighbours]`.
+
+        Neighbourhood is cached, since it requires inspecting all pairs of
+        nodes. The cache is checked against addresses, positions and radio
+        ranges of the nodes, so it is re-computed after any change of them,
+        including direct changes of `Node` objects shared between topologies
+        (e.g. after `join()`). Building this fingerprint takes O(N) time on
+        every call, while the neighbourhood itself takes O(N^2).
+
+        Each call returns a new dictionary, so it can be modified freely.
+        """
         nodes = self.nodes.all()
-        neighbours = {node.address: [] for node in nodes}
-        for i, node_a in enumerate(nodes):
-            for node_b in nodes[i+1:]:
-                if distance_between(node_a, node_b) <= min(
-                        node_a.radio_range, node_b.radio_range):
-                    neighbours[node_a.address].append(node_b.address)
-                    neighbours[node_b.address].append(node_a.address)
-        return neighbours
+        key = tuple((node.address, node.x, node.y, node.radio_range)
+                    for node in nodes)
+        if self._neighbours is None or self._neighbours_key != key:
+            # Compare squared distances between nodes with the smallest
+            # radio range in each pair squared (the same way as
+            # `in_radio_range()` does). Pairs are inspected in blocks of rows
+            # to keep memory usage O(N) for large topologies:
+            addresses = [node.address for node in nodes]
+            xs = np.asarray([node.x for node in nodes], dtype=float)
+            ys = np.asarray([node.y for node in nodes], dtype=float)
+            ranges = np.asarray([node.radio_range for node in nodes],
+                                dtype=float)
+            self._neighbours = {}
+            for start in range(0, len(nodes), _NEIGHBOURS_BLOCK_SIZE):
+                end = min(start + _NEIGHBOURS_BLOCK_SIZE, len(nodes))
+                dx = np.subtract.outer(xs[start:end], xs)
+                dy = np.subtract.outer(ys[start:end], ys)
+                dx *= dx
+                dy *= dy
+                dx += dy
+                max_dist = np.minimum.outer(ranges[start:end], ranges)
+                max_dist *= max_dist
+                adjacent = dx <= max_dist
+                adjacent[np.arange(end - start), np.arange(start, end)] = False
+                # Get all adjacent pairs of the block at once (they are
+                # ordered by rows), and split columns into per-node lists
+                # using rows bounds:
+                rows, cols = np.nonzero(adjacent)
+                bounds = np.cumsum(
+                    np.bincount(rows, minlength=end - start)).tolist()
+                cols = [addresses[j] for j in cols.tolist()]
+                self._neighbours.update(
+                    (address, cols[first:last])
+                    for address, first, last in zip(
+                        addresses[start:end], [0] + bounds[:-1], bounds))
+            self._neighbours_key = key
+        return {addr: list(adj) for addr, adj in self._neighbours.items()}
 
     def shift_addresses(self, offset: int):
         # Update nodes:
@@ -198,6 +274,15 @@ class Topology:
             from_addr + offset: to_addr + offset
             for from_addr, to_addr in self._connections.items()}
         self._connections = new_connections
+        self._build_indices()
+
+    def _build_indices(self):
+        self._nodes_by_type.clear()
+        for address, node in self._nodes.items():
+            self._nodes_by_type[node.type][address] = node
+        self._incoming.clear()
+        for from_addr, to_addr in self._connections.items():
+            self._incoming[to_addr].add(from_addr)
 
     def shift_pos(self, dx, dy):
         for node in self.nodes.all():
@@ -209,7 +294,7 @@ class Topology:
         nodes, connections = [], []
         for t in topologies:
             nodes.extend(t.nodes.all())
-            connections.extend(t.connections.all())
+            connections.extend(t.connections.items())
         return Topology(nodes=nodes, connections=connections)
 
     def __str__(self):
@@ -237,7 +322,13 @@ class NodesManager:
     def add(self, address, node_type, x, y, radio_range=None):
         radio_range = radio_range or defaults['radio_range']
         node = Node(address, node_type, x, y, radio_range)
+        old_node = self.__owner._nodes.get(address)
         self.__owner._nodes[address] = node
+        if old_node is not None and old_node.type != node_type:
+            # Rebuild indices, so nodes of each type keep the table order:
+            self.__owner._build_indices()
+        else:
+            self.__owner._nodes_by_type[node_type][address] = node
 
     def add_from(self, sequence):
         for record in sequence:
@@ -246,11 +337,29 @@ class NodesManager:
             else:
                 self.add(*record)
 
+    def bulk_add(self, nodes):
+        """Add ready `Node` objects at once.
+        """
+        table = self.__owner._nodes
+        nodes_by_type = self.__owner._nodes_by_type
+        types_changed = False
+        for node in nodes:
+            old_node = table.get(node.address)
+            table[node.address] = node
+            if old_node is not None and old_node.type != node.type:
+                types_changed = True
+            else:
+                nodes_by_type[node.type][node.address] = node
+        if types_changed:
+            # Rebuild indices, so nodes of each type keep the table order:
+            self.__owner._build_indices()
+
     def remove(self, address):
         try:
-            del self.owner._nodes[address]
+            node = self.owner._nodes.pop(address)
         except KeyError:
             return 0
+        del self.owner._nodes_by_type[node.type][address]
         connections = self.__owner.connections
         for from_addr, _ in connections.filter(address=address):
             connections.remove(from_addr)
@@ -265,13 +374,17 @@ class NodesManager:
     def all(self, order_by=None):
         nodes = list(self.__owner._nodes.values())
         if order_by is not None:
-            nodes.sort(key=(lambda node: getattr(node, order_by)))
+            nodes.sort(key=attrgetter(order_by))
         return nodes
 
     def values(self, keys, order_by=None, flat=False):
-        nodes = self.all(order_by)
         if flat and len(keys) == 1:
-            return [getattr(node, keys[0]) for node in nodes]
+            getter = attrgetter(keys[0])
+            if order_by == keys[0]:
+                # Sorting values is cheaper than sorting nodes by them:
+                return sorted(map(getter, self.__owner._nodes.values()))
+            return list(map(getter, self.all(order_by)))
+        nodes = self.all(order_by)
         return [{key: getattr(node, key) for key in keys} for node in nodes]
 
     def get(self, address):
@@ -296,39 +409,46 @@ class NodesManager:
 
         :return a list of nodes matching filters
         """
-        nodes = self.all(order_by=None)
-        #
-        # 1) Inspecting nodes types:
-        #
+        # Select candidates using the most specific index available, and
+        # check all filters in a single pass over them. Indices keep the
+        # nodes table order:
+        if 'address' in kwargs:
+            node = self.__owner._nodes.get(kwargs['address'])
+            candidates = [node] if node is not None else []
+        elif 'type' in kwargs:
+            candidates = self.__owner._nodes_by_type.get(
+                kwargs['type'], {}).values()
+        else:
+            candidates = self.__owner._nodes.values()
+        predicates = []
         if 'type' in kwargs:
-            nodes = [n for n in nodes if n.type == kwargs['type']]
+            predicates.append(lambda n, v=kwargs['type']: n.type == v)
         if 'type__in' in kwargs:
-            nodes = [n for n in nodes if n.type in kwargs['type__in']]
+            predicates.append(lambda n, v=kwargs['type__in']: n.type in v)
         if 'type__not_in' in kwargs:
-            nodes = [n for n in nodes if n.type not in kwargs['type__not_in']]
-        #
-        # 2) Inspecting node addresses:
-        #
+            predicates.append(
+                lambda n, v=kwargs['type__not_in']: n.type not in v)
         if 'address' in kwargs:
-            address = kwargs['address']
-            nodes = [n for n in nodes if n.address == address]
+            predicates.append(lambda n, v=kwargs['address']: n.address == v)
         if 'address__in' in kwargs:
-            address_set = kwargs['address__in']
-            nodes = [n for n in nodes if n.address in address_set]
+            predicates.append(
+                lambda n, v=kwargs['address__in']: n.address in v)
         if 'address__not_in' in kwargs:
-            address_set = kwargs['address_not_in']
-            nodes = [n for n in nodes if n.address not in address_set]
+            predicates.append(
+                lambda n, v=kwargs['address__not_in']: n.address not in v)
+        nodes = [n for n in candidates
+                 if all(predicate(n) for predicate in predicates)]
 
         if order_by is not None:
-            nodes.sort(key=(lambda node: getattr(node, order_by)))
+            nodes.sort(key=attrgetter(order_by))
         return nodes
 
 
 # noinspection PyProtectedMember
 class ConnectionsManager:
     ORDER_KEYS = {
-        'from_addr': lambda c: c[0],
-        'to_addr': lambda c: c[1],
+        'from_addr': itemgetter(0),
+        'to_addr': itemgetter(1),
     }
 
     def __init__(self, owner, can_connect=None):
@@ -343,7 +463,11 @@ class ConnectionsManager:
         from_node = self.__owner.nodes.get(from_addr)
         to_node = self.__owner.nodes.get(to_addr)
         if self.can_connect(from_node, to_node):
+            if from_addr in self.__owner._connections:
+                old_to_addr = self.__owner._connections[from_addr]
+                self.__owner._incoming[old_to_addr].discard(from_addr)
             self.__owner._connections[from_addr] = to_addr
+            self.__owner._incoming[to_addr].add(from_addr)
         else:
             raise ValueError(f'nodes {from_addr} and {to_addr} '
                              f'can not be connected')
@@ -355,12 +479,26 @@ class ConnectionsManager:
             else:
                 self.add(*record)
 
+    def bulk_add(self, sequence):
+        """Add `(from_addr, to_addr)` connections without checking whether
+        nodes can be connected. Use it only for connections which are known
+        to be valid, e.g. built by topology generators.
+        """
+        connections = self.__owner._connections
+        incoming = self.__owner._incoming
+        for from_addr, to_addr in sequence:
+            if from_addr in connections:
+                incoming[connections[from_addr]].discard(from_addr)
+            connections[from_addr] = to_addr
+            incoming[to_addr].add(from_addr)
+
     def remove(self, from_addr):
         try:
-            del self.owner._connections[from_addr]
-            return 1
+            to_addr = self.owner._connections.pop(from_addr)
         except KeyError:
             return 0
+        self.owner._incoming[to_addr].discard(from_addr)
+        return 1
 
     def count(self):
         return len(self.owner._connections)
@@ -372,18 +510,31 @@ class ConnectionsManager:
         return from_addr in self.owner._connections
 
     def all(self, order_by=None):
-        connections = [
-            (key, value) for key, value in self.owner._connections.items()]
-        if order_by is not None:
-            connections.sort(key=ConnectionsManager.ORDER_KEYS[order_by])
-        return connections
+        if order_by is None:
+            return list(self.owner._connections.items())
+        return sorted(self.owner._connections.items(),
+                      key=ConnectionsManager.ORDER_KEYS[order_by])
+
+    def items(self):
+        """Iterate over `(from_addr, to_addr)` pairs without copying them.
+
+        Connections must not be modified during the iteration.
+        """
+        return iter(self.owner._connections.items())
 
     def filter(self, order_by=None, **kwargs):
-        connections = self.all()
         if 'address' in kwargs:
+            # Use incoming connections index instead of scanning all:
             address = kwargs['address']
             connections = [
-                c for c in connections if c[0] == address or c[1] == address]
+                (from_addr, address)
+                for from_addr in self.owner._incoming.get(address, ())
+                if from_addr != address]
+            if address in self.owner._connections:
+                connections.insert(
+                    0, (address, self.owner._connections[address]))
+        else:
+            connections = self.all()
         if order_by is not None:
             connections.sort(key=ConnectionsManager.ORDER_KEYS[order_by])
         return connections
@@ -432,21 +583,24 @@ def build_tree_topology(depth, arity=1, dx=10, dy=10, roe=0.1):
     # Compute addresses of the leftmost node at each level:
     first_address = np.cumsum([1] + list(num_nodes))[:-1]
 
-    # Now we can build a topology. We start from the gateway at the root:
-    topology = Topology()
-    topology.nodes.add(1, GATEWAY_NODE, pos_x[0][0], pos_y[0], R[0])
-    address = 2
+    # Now we can build nodes and connections level by level, starting from
+    # the gateway at the root. Parent of i-th node at d-th level is
+    # (i // A)-th node at level (d - 1):
+    nodes = [Node(1, GATEWAY_NODE, pos_x[0][0], pos_y[0], R[0])]
+    connections = []
     for d in range(1, D + 1):
-        parent = first_address[d - 1]
         y = pos_y[d]
         r = max(R[d - 1], R[d])
-        for i in range(num_nodes[d]):
-            if i > 0 and i % A == 0:
-                parent += 1
-            topology.nodes.add(address, SENSOR_NODE, pos_x[d][i], y, r)
-            topology.connections.add(address, parent)
-            address += 1
-    return topology
+        addresses = (first_address[d] + np.arange(num_nodes[d])).tolist()
+        parents = (first_address[d - 1] +
+                   np.arange(num_nodes[d]) // A).tolist()
+        nodes.extend(Node(address, SENSOR_NODE, x, y, r)
+                     for address, x in zip(addresses, pos_x[d]))
+        connections.extend(zip(addresses, parents))
+
+    # All connections are within radio ranges by construction, so we pass
+    # them to the topology directly without checking:
+    return Topology(nodes=nodes, connections=connections)
 
 
 def build_forest_topology(num_trees, depth, arity=1, dx=10, dy=10, roe=0.1,
@@ -454,14 +608,15 @@ def build_forest_topology(num_trees, depth, arity=1, dx=10, dy=10, roe=0.1,
     trees = [build_tree_topology(depth, arity, dx, dy, roe)
              for _ in range(num_trees)]
 
-    for i, tree in enumerate(trees):
-        if i == 0:
-            continue
-        prev_tree = trees[i - 1]
-        address_offset = max(prev_tree.nodes.values(['address'], flat=True))
-        x = max(prev_tree.nodes.values(['x'], flat=True))
-        tree.shift_addresses(address_offset)
-        tree.shift_pos(x + dt, 0)
+    # All trees are the same, and their nodes have addresses 1, 2, ..., N,
+    # so we find the number of nodes and the tree width only once, and
+    # shift i-th tree by i times these values:
+    if trees:
+        num_nodes = trees[0].nodes.count()
+        width = max(trees[0].nodes.values(['x'], flat=True))
+    for i, tree in enumerate(trees[1:], start=1):
+        tree.shift_addresses(i * num_nodes)
+        tree.shift_pos(i * (width + dt), 0)
 
     forest = Topology.join(*trees)
     return forest
@@ -482,20 +637,19 @@ def build_random_topology(num_gateways, num_sensors, radio_range=10.0,
 
     # 3) Create a topology and add nodes:
     t = Topology()
-    t.nodes.add_from([
-        {'address': i + 1, 'node_type': GATEWAY_NODE,
-         'x': pos[0], 'y': pos[1], 'radio_range': radio_range
-         } for i, pos in enumerate(gateways_positions)])
-    t.nodes.add_from([
-        {'address': i + num_gateways + 1, 'node_type': SENSOR_NODE,
-         'x': pos[0], 'y': pos[1], 'radio_range': radio_range
-         } for i, pos in enumerate(sensors_positions)])
-
-    # 4) Build shortest paths from gateways:
+    t.nodes.bulk_add(
+        Node(i + 1, GATEWAY_NODE, pos[0], pos[1], radio_range)
+        for i, pos in enumerate(gateways_positions))
+    t.nodes.bulk_add(
+        Node(i + num_gateways + 1, SENSOR_NODE, pos[0], pos[1], radio_range)
+        for i, pos in enumerate(sensors_positions))
+
+    # 4) Build shortest paths from gateways. Next hops are always
+    # neighbours, so connections are added without checks:
     from .routing import build_routes
     routes = build_routes(t)
-    for route in routes:
-        if route.source != route.gateway:
-            t.connections.add(route.source, route.next_hop)
+    t.connections.bulk_add(
+        (route.source, route.next_hop) for route in routes
+        if route.source != route.gateway)
 
     return t
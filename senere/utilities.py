@@ -1,5 +1,5 @@
 from enum import Enum
-from itertools import product
+from math import hypot
 
 import numpy as np
 
@@ -8,13 +8,46 @@ def count_distance(pos0, pos1):
     """Get distance between points with positions `pos0` and `pos1`.
 
     >>> count_distance([0,0], [3,4])
-    5
+    5.0
     >>> print('%.2f'%count_distance((2.2, 1.4), (5.0, 4.4)))
     4.10
     """
-    dx = pos1[0] - pos0[0]
-    dy = pos1[1] - pos0[1]
-    return (dx**2 + dy**2)**0.5
+    return hypot(pos1[0] - pos0[0], pos1[1] - pos0[1])
+
+
+class _FenwickTree:
+    """Fenwick (binary indexed) tree over a list of non-negative counts.
+
+    Allows to update a count and find an index by a prefix sum in
+    O(log N) time.
+    """
+    def __init__(self, values=()):
+        self._size = len(values)
+        self._tree = [0] + list(values)
+        for i in range(1, self._size + 1):
+            j = i + (i & -i)
+            if j <= self._size:
+                self._tree[j] += self._tree[i]
+
+    def add(self, index, delta):
+        i = index + 1
+        while i <= self._size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def find(self, n):
+        """Find the smallest index, which prefix sum (including the value
+        at this index) is greater than `n`.
+
+        :return a tuple `(index, n - sum of values before index)`
+        """
+        pos, step = 0, 1 << self._size.bit_length()
+        while step > 0:
+            if pos + step <= self._size and self._tree[pos + step] <= n:
+                pos += step
+                n -= self._tree[pos]
+            step >>= 1
+        return pos, n
 
 
 class GridArea:
@@ -32,11 +65,19 @@ class GridArea:
         self.r_min, self.r_max = r_min, r_max
         if self.r_max - self.r_min < 1:
             raise ValueError('(r_max - r_min) must be >= 1')
+        # Cells around a point within r_min (disk) and between r_min and
+        # r_max (ring) as boolean masks centered at (r, r):
+        r = self._stencil_radius = int(np.ceil(r_max))
+        offsets = np.arange(-r, r + 1)
+        distances = np.sqrt(offsets[:, np.newaxis] ** 2 + offsets ** 2)
+        self._disk = distances <= r_min
+        self._ring = (distances > r_min) & (distances <= r_max)
         # Initialize the area:
         self._max_x, self._max_y = 0, 0
         self._num_empty_per_row = []
+        self._empty_rows = _FenwickTree()  # to find n-th empty cell row
         self._num_empty = 0
-        self._area = np.zeros((0, 0))
+        self._area = np.zeros((0, 0), dtype=np.int8)
         self._points = []
         self._initial_points = []
         # Add points:
@@ -53,7 +94,7 @@ class GridArea:
 
     @property
     def area(self):
-        return self._area
+        return self._area[:self._max_x, :self._max_y]
 
     @property
     def all_points(self):
@@ -82,17 +123,12 @@ class GridArea:
         if self._num_empty == 0:
             raise ValueError('no empty cells')
         n = np.random.randint(self._num_empty)
-        cs = np.cumsum(self._num_empty_per_row)
-        y = 0
-        while cs[y] <= n:
-            y += 1
-        n -= cs[y - 1] if y > 0 else 0
-        for x in range(self.max_x):
-            if self._area[x][y] == GridArea.EMPTY:
-                if n == 0:
-                    return x, y
-                n -= 1
-        raise RuntimeError('empty cell not found!')
+        y, n = self._empty_rows.find(n)
+        if y >= self.max_y:
+            raise RuntimeError('empty cell not found!')
+        columns = np.flatnonzero(
+            self._area[:self._max_x, y] == GridArea.EMPTY)
+        return int(columns[n]), y
 
     def add(self, pos, initial=False):
         x0, y0 = pos
@@ -113,47 +149,37 @@ class GridArea:
         max_y = max(int(y0 + self.r_max) + 1, self.max_y)
         self.resize(max_x, max_y)
 
-        # Mark NONE points inside r_min circle as BUSY:
-        square = product(
-            range(max(0, int(x0 - self.r_min)), int(x0 + self.r_min) + 1),
-            range(max(0, int(y0 - self.r_min)), int(y0 + self.r_min) + 1))
-        for x, y in square:
-            # skip corner points out of the circle:
-            if count_distance((x, y), (x0, y0)) > self.r_min:
-                continue
-            # no other points can be inside the busy area:
-            ct = self._area[x][y]
-            if ct == GridArea.OCCUPIED:
-                raise ValueError(f'point {x0},{y0} is too close to occupied'
-                                 f'point {x},{y}')
-            # if a point was EMPTY, we need to de-count it:
-            if ct == GridArea.EMPTY:
-                self._num_empty_per_row[y] -= 1
-                self._num_empty -= 1
-
-            # all other points (inside circle, not occupied) are now busy:
-            self._area[x][y] = GridArea.BUSY
+        # Cut the area around (x0, y0) and the matching parts of stencils
+        # (the area may be smaller near its borders):
+        r = self._stencil_radius
+        x_lo, x_hi = max(0, x0 - r), min(self.max_x, x0 + r + 1)
+        y_lo, y_hi = max(0, y0 - r), min(self.max_y, y0 + r + 1)
+        square = self._area[x_lo:x_hi, y_lo:y_hi]  # a view, not a copy
+        stencil = (slice(x_lo - x0 + r, x_hi - x0 + r),
+                   slice(y_lo - y0 + r, y_hi - y0 + r))
+        disk, ring = self._disk[stencil], self._ring[stencil]
+
+        # No other points can be inside the r_min circle:
+        occupied = np.argwhere(disk & (square == GridArea.OCCUPIED))
+        if len(occupied) > 0:
+            x, y = occupied[0] + (x_lo, y_lo)
+            raise ValueError(f'point {x0},{y0} is too close to occupied'
+                             f'point {x},{y}')
+
+        # Mark all points inside r_min circle as BUSY. If a point was EMPTY,
+        # we need to de-count it:
+        self._count_empty(y_lo, disk & (square == GridArea.EMPTY), -1)
+        square[disk] = GridArea.BUSY
 
         # After marking busy points, mark (x0, y0) as occupied. We don't
-        # check whether this point was empty, since after the cycle
-        # it is already marked as BUSY:
+        # check whether this point was empty, since it is already marked
+        # as BUSY:
         self._area[x0][y0] = GridArea.OCCUPIED
 
         # Mark NONE points in a ring between r_min and r_max as EMPTY:
-        square = product(
-            range(max(0, int(x0 - self.r_max)), int(x0 + self.r_max) + 1),
-            range(max(0, int(y0 - self.r_max)), int(y0 + self.r_max) + 1))
-        for x, y in square:
-            distance = count_distance((x, y), (x0, y0))
-            # Skip points not laying inside the ring:
-            if not (self.r_min < distance <= self.r_max):
-                continue
-            # Inspect cell type, mark it as EMPTY if it was NONE:
-            ct = self._area[x][y]
-            if ct == GridArea.NONE:
-                self._num_empty_per_row[y] += 1
-                self._num_empty += 1
-                self._area[x][y] = GridArea.EMPTY
+        new_empty = ring & (square == GridArea.NONE)
+        self._count_empty(y_lo, new_empty, 1)
+        square[new_empty] = GridArea.EMPTY
 
         # Finally, add the point to the points list:
         if initial:
@@ -161,19 +187,40 @@ class GridArea:
         else:
             self._points.append((x0, y0))
 
+    def _count_empty(self, y_lo, mask, sign):
+        """Update empty cells counters for cells marked in the `mask`.
+        Mask columns correspond to rows, starting from `y_lo`.
+        """
+        num_cells = mask.sum(axis=0)
+        for j in np.flatnonzero(num_cells).tolist():
+            delta = sign * int(num_cells[j])
+            self._num_empty_per_row[y_lo + j] += delta
+            self._empty_rows.add(y_lo + j, delta)
+            self._num_empty += delta
+
     def resize(self, max_x, max_y):
         if max_x < self._max_x or max_y < self._max_y:
             raise ValueError('area size can not be reduced')
         if max_x == self._max_x and max_y == self._max_y:
             return  # do nothing if no actual resize takes place
 
-        # Create new area and copy old area into it:
-        new_area = np.zeros((max_x, max_y))
-        new_area[:self._max_x, :self._max_y] = self._area
-        self._area = new_area
-
-        # Extend num_empty_per_row:
-        self._num_empty_per_row.extend([0] * (max_y - self._max_y))
+        # If the area doesn't fit into allocated array, create a new one at
+        # least twice as large and copy old area into it. This way copying
+        # takes amortized O(1) time per cell, when area grows gradually:
+        capacity_x, capacity_y = self._area.shape
+        if max_x > capacity_x or max_y > capacity_y:
+            if max_x > capacity_x:
+                capacity_x = max(max_x, 2 * capacity_x)
+            if max_y > capacity_y:
+                capacity_y = max(max_y, 2 * capacity_y)
+            new_area = np.zeros((capacity_x, capacity_y), dtype=np.int8)
+            new_area[:self._area.shape[0], :self._area.shape[1]] = self._area
+            self._area = new_area
+
+            # Extend num_empty_per_row to the allocated rows number:
+            self._num_empty_per_row.extend(
+                [0] * (capacity_y - len(self._num_empty_per_row)))
+            self._empty_rows = _FenwickTree(self._num_empty_per_row)
 
         # Store new sizes:
         self._max_x = max_x
@@ -0,0 +1,182 @@
+from itertools import product
+
+import pytest
+
+from senere.network import Network
+from senere.topology import Topology, GATEWAY_NODE, SENSOR_NODE
+
+
+def build_chain_topology():
+    """Build a topology with a chain of sensors and a lone sensor:
+
+    ```
+    [1] <--- (2) <--- (3) <--- (4)         (5)
+    ```
+    """
+    topology = Topology()
+    topology.nodes.add(1, GATEWAY_NODE, x=0, y=0, radio_range=6)
+    topology.nodes.add(2, SENSOR_NODE, x=5, y=0, radio_range=6)
+    topology.nodes.add(3, SENSOR_NODE, x=10, y=0, radio_range=6)
+    topology.nodes.add(4, SENSOR_NODE, x=15, y=0, radio_range=6)
+    topology.nodes.add(5, SENSOR_NODE, x=50, y=0, radio_range=6)
+    topology.connections.add_from([(2, 1), (3, 2), (4, 3)])
+    return topology
+
+
+#
+# TEST TURNING NODES OFF
+#
+def test_turn_off_removes_routes_of_all_descendants():
+    """Check that turning a node off removes all routes going through it.
+    """
+    network = Network(build_chain_topology())
+    network.build_routing_table(Network.STATIC)
+    network.turn_off(3)
+
+    assert network.turned_off() == [3]
+    assert sorted(r.source for r in network.routing_table.all()
+                  if r is not None) == [1, 2]
+    assert sorted(network.get_offline_nodes()) == [3, 4]
+    assert network.num_offline == 2
+
+
+def test_turn_off_ignores_unrouted_nodes():
+    """Check that sensors without routes do not break routes removal.
+    """
+    network = Network(build_chain_topology())
+    network.build_routing_table(Network.STATIC)
+    network.turn_off(2)
+    network.turn_off(5)
+
+    assert sorted(network.turned_off()) == [2, 5]
+    assert sorted(network.get_offline_nodes()) == [2, 3, 4, 5]
+    assert network.num_offline == 4
+
+
+#
+# TEST ROUTING TABLE
+#
+def test_routing_table_filter_by_address_and_distance():
+    """Check that routing table filters are conjuncted.
+    """
+    network = Network(build_chain_topology())
+    network.build_routing_table(Network.STATIC)
+
+    records = network.routing_table.filter(address=3, order_by='source')
+    assert [(r.source, r.next_hop) for r in records] == [(3, 2), (4, 3)]
+
+    records = network.routing_table.filter(address=3, distance=3)
+    assert [(r.source, r.next_hop) for r in records] == [(4, 3)]
+
+
+#
+# TEST DEVICES
+#
+def test_sensors_gateways_and_turned_off_devices():
+    network = Network(build_chain_topology())
+    assert network.gateways() == [1]
+    assert sorted(network.sensors()) == [2, 3, 4, 5]
+    assert network.turned_off() == []
+
+    network.turn_off(3)
+    network.turn_off(5)
+    assert sorted(network.turned_off()) == [3, 5]
+
+    network.turn_on([3, 5])
+    assert network.turned_off() == []
+
+
+def test_turn_on_accepts_string_addresses():
+    topology = Topology()
+    topology.nodes.add('gw', GATEWAY_NODE, x=0, y=0, radio_range=6)
+    topology.nodes.add('s1', SENSOR_NODE, x=5, y=0, radio_range=6)
+    network = Network(topology)
+
+    network.turn_off('s1')
+    assert network.turned_off() == ['s1']
+    network.turn_on('s1')
+    assert network.turned_off() == []
+
+
+#
+# TEST ROUTES REPAIR
+#
+def build_grid_topology():
+    """Build a 4x4 grid of nodes with gateways in two opposite corners.
+
+    Each node can reach only its horizontal and vertical neighbours.
+    Static connections of sensors lead to the gateway #1 along rows and
+    then along the first column.
+    """
+    gateways = (1, 16)
+    topology = Topology()
+    for row, col in product(range(4), range(4)):
+        address = row * 4 + col + 1
+        node_type = GATEWAY_NODE if address in gateways else SENSOR_NODE
+        topology.nodes.add(address, node_type, x=col*10, y=row*10,
+                           radio_range=11)
+    for row, col in product(range(4), range(4)):
+        address = row * 4 + col + 1
+        if address in gateways:
+            continue
+        if col > 0:
+            topology.connections.add(address, address - 1)
+        elif row > 0:
+            topology.connections.add(address, address - 4)
+    return topology
+
+
+def get_distances(network):
+    return {r.source: r.distance for r in network.routing_table.all()
+            if r is not None}
+
+
+@pytest.mark.parametrize('mode', [Network.STATIC, Network.DYNAMIC])
+def test_routes_repaired_like_rebuilt_after_turning_nodes_off_and_on(mode):
+    """Check that after each turning on or off, routing table distances
+    are the same as in a freshly built routing table.
+    """
+    topology = build_grid_topology()
+    network = Network(topology)
+    network.build_routing_table(mode)
+
+    for address, turn_on in [(6, False), (2, False), (5, False), (11, False),
+                             (2, True), (12, False), (8, False),
+                             (6, True), (5, True), (8, True), (11, True),
+                             (12, True)]:
+        if turn_on:
+            network.turn_on(address)
+        else:
+            network.turn_off(address)
+        expected = Network(topology)
+        for off_address in network.turned_off():
+            expected.turn_off(off_address)
+        expected.build_routing_table(mode)
+        assert get_distances(network) == get_distances(expected)
+        assert network.num_offline == len(network.get_offline_nodes())
+
+
+def test_dynamic_routes_use_new_neighbours_after_turn_off():
+    """Check that in dynamic mode nodes find alternative routes.
+
+    ```
+    [1] <--- (2) <--- (3)
+     ^                 .
+     +------ (4) ......+
+    ```
+    """
+    topology = Topology()
+    topology.nodes.add(1, GATEWAY_NODE, x=0, y=0, radio_range=6)
+    topology.nodes.add(2, SENSOR_NODE, x=5, y=0, radio_range=6)
+    topology.nodes.add(3, SENSOR_NODE, x=5, y=5, radio_range=6)
+    topology.nodes.add(4, SENSOR_NODE, x=0, y=5, radio_range=6)
+    network = Network(topology)
+    network.build_routing_table(Network.DYNAMIC)
+    network.turn_off(2)
+    network.turn_off(4)
+    assert sorted(network.get_offline_nodes()) == [2, 3, 4]
+
+    network.turn_on(4)
+    assert sorted(network.get_offline_nodes()) == [2]
+    route = network.routing_table.get(3)
+    assert (route.next_hop, route.gateway, route.distance) == (4, 1, 2)
@@ -185,3 +185,28 @@ def test_build_routes_with_excluded_nodes():
     assert RouteRecord(4, 1, 1, 1, False) in routes
     assert RouteRecord(5, 4, 1, 2, False) in routes
     assert RouteRecord(3, 5, 1, 3, False) in routes
+
+
+def test_build_routes_for_star_topology():
+    """Check that sensors having only gateway as neighbour are routed to it.
+
+    Topology:
+    ```
+            (3)
+             |
+     (2) -- [1] -- (4) -- (5)
+    ```
+    """
+    topology = Topology()
+    topology.nodes.add(1, GATEWAY_NODE, x=0, y=0, radio_range=6)
+    topology.nodes.add(2, SENSOR_NODE, x=-5, y=0, radio_range=6)
+    topology.nodes.add(3, SENSOR_NODE, x=0, y=5, radio_range=6)
+    topology.nodes.add(4, SENSOR_NODE, x=5, y=0, radio_range=6)
+    topology.nodes.add(5, SENSOR_NODE, x=10, y=0, radio_range=6)
+    routes = build_routes(topology)
+    assert len(routes) == 5
+    assert RouteRecord(1, 1, 1, 0, True) in routes
+    assert RouteRecord(2, 1, 1, 1, False) in routes
+    assert RouteRecord(3, 1, 1, 1, False) in routes
+    assert RouteRecord(4, 1, 1, 1, False) in routes
+    assert RouteRecord(5, 4, 1, 2, False) in routes
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from senere.simulation import average_pmfs, simulate_network
+from senere.topology import build_tree_topology
+
+
+def test_average_pmfs_pads_shorter_pmfs_with_zeros():
+    ret = average_pmfs([{0: 0.5, 1: 0.5}, {0: 0.2, 2: 0.8}, {1: 1.0}])
+    np.testing.assert_allclose(ret, [0.7 / 3, 1.5 / 3, 0.8 / 3])
+
+
+def test_average_pmfs_of_empty_list_raises_error():
+    with pytest.raises(ValueError):
+        average_pmfs([])
+
+
+#
+# TEST SIMULATION
+#
+def failure_interval():
+    # Module-level functions, so they can be sent to worker processes:
+    return np.random.exponential(100)
+
+
+def repair_interval():
+    return np.random.exponential(10)
+
+
+def test_parallel_runs_give_the_same_results_as_sequential():
+    topology = build_tree_topology(3, 2, dx=5, dy=5)
+    results = [
+        simulate_network(topology, failure_interval, repair_interval,
+                         stime_limit=2000, num_runs=4, seed=1,
+                         num_workers=num_workers, record_samples=True,
+                         sample_interval=100)
+        for num_workers in (1, 2)
+    ]
+    sequential, parallel = results
+    assert parallel.num_failed_avg == sequential.num_failed_avg
+    assert parallel.num_offline_avg == sequential.num_offline_avg
+    assert parallel.operable == sequential.operable
+    np.testing.assert_array_equal(
+        parallel.num_failed_pmf, sequential.num_failed_pmf)
+    np.testing.assert_array_equal(
+        parallel.num_offline_pmf, sequential.num_offline_pmf)
+    for field in ('num_failed_sampled', 'num_offline_sampled'):
+        for p_values, s_values in zip(getattr(parallel, field),
+                                      getattr(sequential, field)):
+            np.testing.assert_array_equal(p_values, s_values)
+
+
+@pytest.mark.parametrize('failure', [failure_interval, 100.0])
+def test_unseeded_runs_reproducible_after_seeding_numpy(failure):
+    topology = build_tree_topology(3, 2, dx=5, dy=5)
+    results = []
+    for _ in range(2):
+        np.random.seed(7)
+        results.append(simulate_network(
+            topology, failure, repair_interval, stime_limit=2000,
+            num_runs=3))
+    first, second = results
+    assert first.num_failed_avg == second.num_failed_avg
+    assert first.num_offline_avg == second.num_offline_avg
+    assert first.operable == second.operable
+    np.testing.assert_array_equal(first.num_failed_pmf, second.num_failed_pmf)
+
+
+def test_serial_runs_restore_numpy_random_state():
+    topology = build_tree_topology(2, 2, dx=5, dy=5)
+    np.random.seed(3)
+    expected = np.random.random()
+    np.random.seed(3)
+    simulate_network(topology, failure_interval, repair_interval,
+                     stime_limit=1000, num_runs=2, seed=1)
+    assert np.random.random() == expected
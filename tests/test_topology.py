@@ -1,8 +1,8 @@
 from itertools import product
+from math import sqrt
 
 import numpy as np
 import pytest
-from numpy.ma import sqrt
 
 from senere.options import defaults
 from senere.topology import Topology, GATEWAY_NODE, SENSOR_NODE, Node, \
@@ -64,6 +64,137 @@ def test_join():
     assert t.connections.all(order_by='from_addr') == [(2, 1), (11, 10)]
 
 
+def test_neighbours_updated_after_topology_changes():
+    t = Topology()
+    t.nodes.add(1, GATEWAY_NODE, 0, 0, 10)
+    t.nodes.add(2, SENSOR_NODE, 5, 0, 10)
+    assert t.neighbours() == {1: [2], 2: [1]}
+
+    # Returned dictionary is a copy, so modifying it doesn't affect topology:
+    t.neighbours()[1].remove(2)
+    assert t.neighbours() == {1: [2], 2: [1]}
+
+    t.nodes.add(3, SENSOR_NODE, 12, 0, 10)
+    assert t.neighbours() == {1: [2], 2: [1, 3], 3: [2]}
+
+    t.nodes.remove(2)
+    assert t.neighbours() == {1: [], 3: []}
+
+
+def test_neighbours_updated_after_shifting_joined_topology():
+    """Check that joined topology neighbours follow changes of nodes, which
+    are shared with the source topologies.
+    """
+    a = Topology()
+    a.nodes.add(1, GATEWAY_NODE, 0, 0, 10)
+    a.nodes.add(2, SENSOR_NODE, 5, 0, 10)
+    b = Topology()
+    b.nodes.add(3, SENSOR_NODE, 100, 0, 10)
+
+    j = Topology.join(a, b)
+    assert j.neighbours() == {1: [2], 2: [1], 3: []}
+
+    b.shift_pos(-95, 0)
+    assert j.neighbours() == {1: [2, 3], 2: [1, 3], 3: [1, 2]}
+
+    j.nodes.get(2).x = 50
+    assert j.neighbours() == {1: [3], 2: [], 3: [1]}
+
+
+def test_filter_nodes_and_connections():
+    t = Topology()
+    t.nodes.add(1, GATEWAY_NODE, 0, 0, 10)
+    t.nodes.add(2, SENSOR_NODE, 5, 0, 10)
+    t.nodes.add(3, SENSOR_NODE, 10, 0, 10)
+    t.nodes.add(4, SENSOR_NODE, 5, 5, 10)
+    t.connections.add_from([(2, 1), (3, 2), (4, 2)])
+
+    assert t.nodes.filter(type=GATEWAY_NODE) == [t.nodes.get(1)]
+    assert t.nodes.filter(type=SENSOR_NODE, order_by='address') == [
+        t.nodes.get(2), t.nodes.get(3), t.nodes.get(4)]
+    assert t.connections.filter(address=2, order_by='from_addr') == [
+        (2, 1), (3, 2), (4, 2)]
+    assert t.nodes.filter(address=3) == [t.nodes.get(3)]
+    assert t.nodes.filter(address=3, type=GATEWAY_NODE) == []
+    assert t.nodes.filter(address=10) == []
+    assert t.nodes.filter(address__in=[4, 10, 1, 4], order_by='address') == [
+        t.nodes.get(1), t.nodes.get(4)]
+    assert t.nodes.filter(type=SENSOR_NODE, address__not_in=[2, 4]) == [
+        t.nodes.get(3)]
+    # Without ordering, nodes are returned in the table order:
+    assert t.nodes.filter(address__in=[4, 10, 1]) == [
+        t.nodes.get(1), t.nodes.get(4)]
+
+    # Re-connecting node 4 to the gateway and removing node 2 should
+    # update filters results:
+    t.connections.add(4, 1)
+    t.nodes.remove(2)
+    assert t.nodes.filter(type=SENSOR_NODE, order_by='address') == [
+        t.nodes.get(3), t.nodes.get(4)]
+    assert t.connections.filter(address=1) == [(4, 1)]
+    assert t.connections.all() == [(4, 1)]
+
+
+def test_bulk_add_nodes():
+    t = Topology()
+    t.nodes.add(1, SENSOR_NODE, 0, 0, 10)
+    assert t.neighbours() == {1: []}
+
+    t.nodes.bulk_add([Node(1, GATEWAY_NODE, 0, 0, 10),
+                      Node(2, SENSOR_NODE, 5, 0, 10)])
+    assert t.nodes.count() == 2
+    assert t.nodes.filter(type=GATEWAY_NODE) == [
+        Node(1, GATEWAY_NODE, 0, 0, 10)]
+    assert t.nodes.filter(type=SENSOR_NODE) == [
+        Node(2, SENSOR_NODE, 5, 0, 10)]
+    assert t.neighbours() == {1: [2], 2: [1]}
+
+
+def test_filter_nodes_keeps_table_order_after_replacing_nodes():
+    t = Topology()
+    t.nodes.add(1, GATEWAY_NODE, 0, 0, 10)
+    t.nodes.add(2, GATEWAY_NODE, 5, 0, 10)
+    t.nodes.add(3, SENSOR_NODE, 10, 0, 10)
+    t.nodes.add(1, SENSOR_NODE, 0, 0, 10)
+    assert t.nodes.filter(type=SENSOR_NODE) == [
+        t.nodes.get(1), t.nodes.get(3)]
+
+    t.nodes.bulk_add([Node(3, GATEWAY_NODE, 10, 0, 10)])
+    assert t.nodes.filter(type=GATEWAY_NODE) == [
+        t.nodes.get(2), t.nodes.get(3)]
+
+
+def test_bulk_add_connections_skips_radio_range_check():
+    t = Topology()
+    t.nodes.add(1, GATEWAY_NODE, 0, 0, 10)
+    t.nodes.add(2, SENSOR_NODE, 5, 0, 10)
+    t.nodes.add(3, SENSOR_NODE, 50, 0, 10)
+    with pytest.raises(ValueError):
+        t.connections.add(3, 1)
+
+    t.connections.bulk_add([(2, 1), (3, 1), (3, 2)])
+    assert t.connections.all(order_by='from_addr') == [(2, 1), (3, 2)]
+    assert t.connections.filter(address=1) == [(2, 1)]
+
+
+def test_connections_and_neighbours_graphs():
+    t = Topology()
+    t.nodes.add(1, GATEWAY_NODE, 0, 0, 10)
+    t.nodes.add(2, SENSOR_NODE, 5, 0, 10)
+    t.nodes.add(3, SENSOR_NODE, 10, 0, 10)
+    t.connections.add_from([(2, 1), (3, 2)])
+
+    graph = t.get_connections_graph()
+    assert sorted(graph.nodes()) == [1, 2, 3]
+    assert sorted(graph.edges()) == [(2, 1), (3, 2)]
+    assert graph.nodes[2]['type'] == SENSOR_NODE
+
+    graph = t.get_neighbours_graph()
+    assert sorted(graph.nodes()) == [1, 2, 3]
+    assert sorted(tuple(sorted(e)) for e in graph.edges()) == [
+        (1, 2), (1, 3), (2, 3)]
+
+
 #############################################################################
 # TOPOLOGY PRODUCING METHODS TESTS
 #############################################################################
@@ -97,27 +228,21 @@ def test_binary_tree_topology():
     # to their parents at level 2:
     range_2 = 1.2 * sqrt(2)
 
-    # Check nodes number and the root:
-    assert t.nodes.count() == 15
-    assert t.nodes.get(1) == Node(1, GATEWAY_NODE, 3.5, 3, range_1)
-
-    # Check nodes at level 1:
-    for i in [0, 1]:
-        addr, x, y = i + 2, 1.5 + 4 * i, 2
-        assert t.nodes.get(addr) == Node(addr, SENSOR_NODE, x, y, range_1)
+    # Expected nodes, level by level, starting from the root:
+    expected_nodes = [Node(1, GATEWAY_NODE, 3.5, 3, range_1)]
+    expected_nodes.extend(
+        Node(i + 2, SENSOR_NODE, 1.5 + 4 * i, 2, range_1) for i in range(2))
+    expected_nodes.extend(
+        Node(i + 4, SENSOR_NODE, 0.5 + 2 * i, 1, range_1) for i in range(4))
+    expected_nodes.extend(
+        Node(i + 8, SENSOR_NODE, i, 0, range_2) for i in range(8))
 
-    # Check nodes at level 2:
-    for i in range(4):
-        addr, x, y = i + 4, 0.5 + 2 * i, 1
-        assert t.nodes.get(addr) == Node(addr, SENSOR_NODE, x, y, range_1)
-
-    # Check nodes at level 3:
-    for i in range(4):
-        addr, x, y = i + 8, i, 0
-        assert t.nodes.get(addr) == Node(addr, SENSOR_NODE, x, y, range_2)
+    # Check all nodes at once:
+    assert t.nodes.count() == 15
+    assert nodes == expected_nodes
 
     # Check connections:
-    assert t.connections.all(order_by='from_addr') == [
+    assert connections == [
         (2, 1), (3, 1), (4, 2), (5, 2), (6, 3), (7, 3),
         (8, 4), (9, 4), (10, 5), (11, 5), (12, 6), (13, 6), (14, 7), (15, 7)]
 
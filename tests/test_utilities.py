@@ -1,6 +1,6 @@
 import pytest
 
-from senere.utilities import count_distance
+from senere.utilities import count_distance, GridArea
 
 
 @pytest.mark.parametrize('pos0, pos1, result', [
@@ -10,3 +10,19 @@ from senere.utilities import count_distance
 def test_count_distance(pos0, pos1, result):
     ret = count_distance(pos0, pos1)
     assert '{:.2f}'.format(ret) == result
+
+
+def test_grid_area_random_empty_points():
+    """Check that random points are taken from EMPTY cells only, and that
+    added points are not closer than `r_min` to each other.
+    """
+    area = GridArea(2, 4, [(5, 5)])
+    for _ in range(20):
+        x, y = area.get_random_empty_point()
+        assert area.area[x][y] == GridArea.EMPTY
+        area.add((x, y))
+
+    points = area.all_points
+    for i, pos0 in enumerate(points):
+        for pos1 in points[i+1:]:
+            assert count_distance(pos0, pos1) > 2